@@ -1,8 +1,9 @@
 import streamlit as st
-import pandas as pd
+import polars as pl
 import sqlite3
 import altair as alt
 import os
+from datetime import datetime, timedelta, timezone
 
 st.set_page_config(page_title="Fairfax Real Estate Dashboard", layout="wide")
 
@@ -13,123 +14,246 @@ if not os.path.exists(db_path):
     st.stop()
 
 # --- CONNECT TO DB ---
-conn = sqlite3.connect(db_path)
+@st.cache_resource
+def get_connection():
+    # The dashboard never writes, so open the file read-only and immutable: SQLite skips
+    # locking and journal checks and serves pages straight from the memory map. One
+    # connection is shared by all script threads.
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+    conn.execute("PRAGMA mmap_size=1073741824")
+    conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+conn = get_connection()
 
 @st.cache_data
-def load_data():
-    df = pd.read_sql_query("SELECT * FROM sales", conn)
-    df['sale_date'] = pd.to_datetime(df['sale_date'])
-    df['sale_validity'] = df['sale_validity'].fillna("Unknown").str.strip().str.upper()
-    return df
-
-df = load_data()
-if df.empty:
+def load_metadata():
+    min_date, max_date = conn.execute("SELECT MIN(sale_date), MAX(sale_date) FROM sales").fetchone()
+    raw = pl.DataFrame(
+        {'sale_validity': [row[0] for row in conn.execute("SELECT DISTINCT sale_validity FROM sales")]},
+        schema={'sale_validity': pl.String},
+    )
+    validities = raw.select(SALE_VALIDITY.unique())['sale_validity'].to_list()
+    return min_date, max_date, validities
+
+# Only the columns the dashboard uses, in the narrowest types that hold them. Sale
+# prices are whole dollars well below 2**31.
+SALES_SCHEMA = {
+    'sale_date': pl.String,
+    'property_id': pl.Categorical,
+    'price': pl.Int32,
+    'tax_year': pl.Int16,
+    'sale_validity': pl.String,
+}
+
+# Missing or inconsistently formatted sale types are cleaned with Polars string kernels.
+SALE_VALIDITY = pl.col('sale_validity').fill_null("Unknown").str.strip_chars().str.to_uppercase()
+
+PARQUET_PATH = "sales.parquet"
+
+@st.cache_resource(show_spinner="Loading sales…")
+def load_sales():
+    # The Parquet sidecar is exported from SQLite, and again whenever the database or
+    # this script is newer than it.
+    if not os.path.exists(PARQUET_PATH) or os.path.getmtime(PARQUET_PATH) < max(
+        os.path.getmtime(__file__), os.path.getmtime(db_path)
+    ):
+        # The validity values are known up front, so store them as an Enum: one-byte
+        # codes that the sidebar filter is matched against.
+        validity = pl.Enum(sorted(load_metadata()[2]))
+        tmp_path = f"{PARQUET_PATH}.{os.getpid()}.tmp"
+        # connectorx reads straight into Arrow buffers. The CAST drops the TIMESTAMP
+        # decltype, which it would otherwise try (and fail) to parse itself.
+        pl.read_database_uri(
+            "SELECT CAST(sale_date AS TEXT) AS sale_date, property_id, price, tax_year, sale_validity FROM sales",
+            f"sqlite://{os.path.abspath(db_path)}",
+            engine="connectorx",
+            schema_overrides=SALES_SCHEMA,
+        ).with_columns(
+            pl.col('sale_date').str.to_datetime('%Y-%m-%d %H:%M:%S%:z', time_zone='UTC'),
+            SALE_VALIDITY.cast(validity),
+        ).sort('sale_date').with_columns(
+            # Integer calendar key, computed once, for the monthly group-by.
+            (pl.col('sale_date').dt.year().cast(pl.Int32) * 100 + pl.col('sale_date').dt.month()).alias('ym'),
+        ).write_parquet(tmp_path, compression='zstd')
+        # Rename into place so a killed or concurrent export never leaves a truncated sidecar.
+        os.replace(tmp_path, PARQUET_PATH)
+    # Rows are stored in sale_date order; flag it so group-bys and slices can rely on it.
+    return pl.read_parquet(PARQUET_PATH).with_columns(
+        pl.col('sale_date', 'ym').set_sorted()
+    )
+
+def load_filtered(start: str, end: str, validities: tuple):
+    start = datetime.fromisoformat(start).replace(tzinfo=timezone.utc)
+    # The end date is inclusive of the whole day.
+    end = datetime.fromisoformat(end).replace(tzinfo=timezone.utc) + timedelta(days=1)
+    sales = load_sales()
+    # sale_date is sorted, so the date range is a slice found by binary search and
+    # only the validity check has to look at each row in it.
+    lo, hi = sales['sale_date'].search_sorted(pl.Series([start, end]), side='left')
+    return sales.slice(lo, max(hi - lo, 0)).lazy().filter(pl.col('sale_validity').is_in(validities))
+
+# Per-filter results stay in memory, where max_entries bounds them. Disk-persisted
+# entries would be written once per filter combination and never evicted.
+@st.cache_data(max_entries=32)
+def dashboard_panels(start: str, end: str, validities: tuple):
+    """Aggregate every panel from one filtered read, executed together by collect_all."""
+    base = load_filtered(start, end, validities)
+    # The monthly means come out in ym order and feed both the line chart and the heatmap.
+    # Per-month sums and counts are rolled up again for the yearly averages, so the YoY
+    # panel never makes its own pass over the sales.
+    months = (
+        base
+        .group_by('ym', maintain_order=True)
+        .agg(pl.col('price').cast(pl.Int64).sum().alias('total'), pl.len().alias('sales'))
+        .with_columns((pl.col('total') / pl.col('sales')).alias('price'))
+    )
+    year = (pl.col('ym') // 100).alias('year')
+    month = (pl.col('ym') % 100).alias('month')
+    property_key = pl.col('property_id').cast(pl.String)
+    plans = {
+        'kpis': base.select(
+            pl.len().alias('sales'),
+            pl.col('price').cast(pl.Int64).sum().alias('volume'),
+            pl.col('price').mean().fill_null(0).alias('avg_price'),
+        ),
+        # The charts derive month labels and heatmap cells from this date themselves.
+        'monthly': months.select(pl.date(year, month, 1).alias('sale_date'), 'price'),
+        # Ties on sales_count are broken by property_id so the table is stable across runs.
+        'top_properties': base
+            .group_by('property_id')
+            .agg(pl.len().alias('sales_count'))
+            .top_k(10, by=['sales_count', property_key], reverse=[False, True])
+            .sort(['sales_count', property_key], descending=[True, False]),
+        'yoy': months
+            .group_by(year, maintain_order=True)
+            .agg((pl.col('total').sum() / pl.col('sales').sum()).alias('price'))
+            .with_columns((pl.col('price').pct_change() * 100).round(2).alias('YoY_Change')),
+        'latest': base
+            .select('sale_date', 'property_id', 'price', 'tax_year', 'sale_validity')
+            .tail(100)
+            .reverse(),
+    }
+    return dict(zip(plans, pl.collect_all(plans.values())))
+
+@st.cache_data(max_entries=32)
+def price_histogram(start: str, end: str, validities: tuple, max_price: int, bins=30):
+    bin_width = max_price // bins
+    return (
+        load_filtered(start, end, validities)
+        .filter(pl.col('price') < max_price)
+        .group_by(((pl.col('price') // bin_width) * bin_width).alias('bin_low'))
+        .agg(pl.len().alias('count'))
+        .sort('bin_low')
+        .with_columns((pl.col('bin_low') + bin_width).alias('bin_high'))
+        .collect()
+    )
+
+first_sale, last_sale, validity_options = load_metadata()
+if first_sale is None:
     st.warning("⚠️ No sales data loaded. Please check your database file.")
     st.stop()
 
 # --- SIDEBAR FILTERS ---
 st.sidebar.title("Filters")
 
-validity_options = sorted(df['sale_validity'].dropna().unique().tolist())
+validity_options = sorted(validity_options)
 default_validity = ['VALID'] if 'VALID' in validity_options else [validity_options[0]]
 validity_filter = st.sidebar.multiselect("Sale Validity", options=validity_options, default=default_validity)
 
-min_date = df['sale_date'].min().date()
-max_date = df['sale_date'].max().date()
+min_date = datetime.fromisoformat(first_sale).date()
+max_date = datetime.fromisoformat(last_sale).date()
 start_date = st.sidebar.date_input("Start Date", value=min_date, min_value=min_date, max_value=max_date)
 end_date = st.sidebar.date_input("End Date", value=max_date, min_value=min_date, max_value=max_date)
 
-# Ensure both dates are timezone-aware
-start_date = pd.to_datetime(start_date).tz_localize("UTC")
-end_date = pd.to_datetime(end_date).tz_localize("UTC")
-
 # --- FILTERED DATA ---
-filtered_df = df[
-    (df['sale_date'] >= start_date) &
-    (df['sale_date'] <= end_date) &
-    (df['sale_validity'].isin(validity_filter))
-]
+filters = (start_date.isoformat(), end_date.isoformat(), tuple(validity_filter))
 
 st.title("📊 Fairfax County Real Estate Sales Dashboard")
 
+panels = dashboard_panels(*filters)
+
 # --- KPI METRICS ---
+summary = panels['kpis'].row(0, named=True)
 col1, col2, col3 = st.columns(3)
-col1.metric("🧾 Total Sales", f"{len(filtered_df):,}")
-col2.metric("💰 Total Volume", f"${filtered_df['price'].sum():,.0f}")
-col3.metric("🏠 Avg. Sale Price", f"${filtered_df['price'].mean():,.0f}")
+col1.metric("🧾 Total Sales", f"{summary['sales']:,}")
+col2.metric("💰 Total Volume", f"${summary['volume']:,.0f}")
+col3.metric("🏠 Avg. Sale Price", f"${summary['avg_price']:,.0f}")
 
 st.markdown("---")
 
+# Each panel is a fragment, so a widget inside one only reruns that panel.
+
 # --- LINE CHART: Monthly Average Price ---
-monthly_avg = (
-    filtered_df
-    .groupby(filtered_df['sale_date'].dt.to_period("M"))['price']
-    .mean()
-    .reset_index()
-)
-monthly_avg['sale_date'] = monthly_avg['sale_date'].astype(str)
-
-st.subheader("📈 Average Sale Price by Month")
-chart = alt.Chart(monthly_avg).mark_line(point=True).encode(
-    x='sale_date:T',
-    y='price:Q',
-    tooltip=['sale_date', 'price']
-).properties(width=800, height=400)
-st.altair_chart(chart)
+@st.fragment
+def monthly_chart_fragment(monthly_avg):
+    st.subheader("📈 Average Sale Price by Month")
+    chart = alt.Chart(monthly_avg).mark_line(point=True).encode(
+        x=alt.X('utcyearmonth(sale_date):T', title='sale_date'),
+        y='price:Q',
+        tooltip=[alt.Tooltip('utcyearmonth(sale_date):T', title='sale_date'), 'price']
+    ).properties(width=800, height=400)
+    st.altair_chart(chart)
+
+monthly_chart_fragment(panels['monthly'])
 
 # --- HEATMAP ---
-st.subheader("📊 Heatmap: Avg. Sale Price by Year & Month")
-heatmap_df = (
-    filtered_df.copy()
-    .assign(year=filtered_df['sale_date'].dt.year, month=filtered_df['sale_date'].dt.month)
-    .groupby(['year', 'month'])['price']
-    .mean()
-    .reset_index()
-)
-
-heatmap = alt.Chart(heatmap_df).mark_rect().encode(
-    x=alt.X('month:O', title='Month'),
-    y=alt.Y('year:O', title='Year'),
-    color=alt.Color('price:Q', scale=alt.Scale(scheme='viridis')),
-    tooltip=['year', 'month', 'price']
-).properties(width=500, height=400)
-st.altair_chart(heatmap)
+@st.fragment
+def heatmap_fragment(monthly_avg):
+    st.subheader("📊 Heatmap: Avg. Sale Price by Year & Month")
+    heatmap = alt.Chart(monthly_avg).mark_rect().encode(
+        x=alt.X('utcmonth(sale_date):O', title='Month'),
+        y=alt.Y('utcyear(sale_date):O', title='Year'),
+        color=alt.Color('price:Q', scale=alt.Scale(scheme='viridis')),
+        tooltip=[
+            alt.Tooltip('utcyear(sale_date):O', title='year'),
+            alt.Tooltip('utcmonth(sale_date):O', title='month'),
+            'price',
+        ]
+    ).properties(width=500, height=400)
+    st.altair_chart(heatmap)
+
+heatmap_fragment(panels['monthly'])
 
 # --- FREQUENTLY SOLD PROPERTIES ---
-st.subheader("🔁 Most Frequently Sold Properties")
-top_props = filtered_df['property_id'].value_counts().head(10).reset_index()
-top_props.columns = ['property_id', 'sales_count']
-st.dataframe(top_props)
+@st.fragment
+def top_properties_fragment(top_props):
+    st.subheader("🔁 Most Frequently Sold Properties")
+    st.dataframe(top_props)
+
+top_properties_fragment(panels['top_properties'])
 
 # --- HISTOGRAM ---
-st.subheader("💸 Sale Price Distribution (< $1.5M)")
-hist_df = filtered_df[filtered_df['price'] < 1_500_000]
-hist_chart = alt.Chart(hist_df).mark_bar().encode(
-    alt.X("price:Q", bin=alt.Bin(maxbins=30), title="Price Range"),
-    y='count()',
-    tooltip=['count()']
-).properties(width=800, height=400)
-st.altair_chart(hist_chart)
+@st.fragment
+def histogram_fragment(filters):
+    st.subheader("💸 Sale Price Distribution")
+    max_price = st.slider(
+        "Sales below", min_value=300_000, max_value=6_000_000, value=1_500_000, step=300_000, format="$%d"
+    )
+    hist_df = price_histogram(*filters, max_price)
+    hist_chart = alt.Chart(hist_df).mark_bar().encode(
+        alt.X("bin_low:Q", bin="binned", title="Price Range"),
+        x2='bin_high:Q',
+        y='count:Q',
+        tooltip=['count']
+    ).properties(width=800, height=400)
+    st.altair_chart(hist_chart)
+
+histogram_fragment(filters)
 
 # --- YOY CHANGE ---
-st.subheader("📈 Year-over-Year % Change in Avg. Price")
-yoy = (
-    filtered_df
-    .groupby(filtered_df['sale_date'].dt.year)['price']
-    .mean()
-    .pct_change()
-    .multiply(100)
-    .round(2)
-    .reset_index(name="YoY_Change")
-)
-yoy.columns = ['year', 'YoY_Change']
-st.line_chart(yoy.set_index('year'))
+@st.fragment
+def yoy_fragment(yoy):
+    st.subheader("📈 Year-over-Year % Change in Avg. Price")
+    st.line_chart(yoy, x='year', y='YoY_Change')
+
+yoy_fragment(panels['yoy'])
 
 # --- SALES TABLE ---
-st.subheader("📋 Filtered Sales Table")
-st.dataframe(
-    filtered_df[['sale_date', 'property_id', 'price', 'tax_year', 'sale_validity']]
-    .sort_values(by='sale_date', ascending=False)
-    .head(100),
-    use_container_width=True
-)
+@st.fragment
+def table_fragment(latest):
+    st.subheader("📋 Filtered Sales Table")
+    st.dataframe(latest, use_container_width=True)
+
+table_fragment(panels['latest'])